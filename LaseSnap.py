@@ -11,6 +11,13 @@ import spectral.io.envi as envi
 import spectral as spy
 from PIL import Image, ImageTk, ImageOps  # For image display
 import logging
+import hashlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sqlite3
+from contextlib import closing
 import numpy as np  # For cube summation
 
 # Global variables for snapshot comparison and project information
@@ -24,6 +31,37 @@ selected_images = []
 loaded_cubes = []
 available_wavelengths = set()  # To store unique wavelengths
 
+# Calibration state: designated capture folders and their master cubes
+dark_frame_folder = ""
+flat_field_folder = ""
+master_dark = None
+master_flat_gain = None
+calibration_signature = ""  # Identifies the masters in use, for the union build cache
+calibration_masters = {}  # master .hdr path -> (signature, data)
+stream_block_rows = 64  # Rows read per block when streaming cubes from disk
+registration_band = 19  # Band used to estimate drift between captures
+registration_lowpass = 0.08  # Width (cycles per pixel) of the Gaussian low-pass applied before correlating
+registration_upsample = 20  # Subpixel resolution of the shift estimate (1/20 pixel)
+registration_min_peak = 0.3  # Normalized correlation below which a shift estimate is not trusted
+registration_max_shift = 20  # Largest drift in pixels that is accepted
+
+# Project catalog: one SQLite index per project folder
+catalog_file_name = 'project_catalog.sqlite'
+current_project_folder = ""
+
+# Streaming PCA/MNF decomposition of union cubes
+decomposition_workers = 4  # Cubes whose band statistics are accumulated in parallel
+
+# Write-behind queue for RGB and cube outputs
+write_workers = 2
+write_memory_cap = 2 * 1024 ** 3  # Bytes of pending output buffers before new writes wait
+write_executor = ThreadPoolExecutor(max_workers=write_workers, thread_name_prefix='output-writer')
+write_results = queue.Queue()  # (description, error, on_complete) reported back to the GUI
+write_condition = threading.Condition()
+pending_write_bytes = 0
+pending_writes = 0
+pending_write_buffers = {}  # id of a queued buffer -> [nbytes, writes still using it]
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
@@ -174,51 +212,95 @@ def process_results():
 
     if len(new_folders_sorted) == total_pictures:
         open_project_window(new_folders_sorted)
-        add_cubes_for_same_wavelength(new_folders_sorted)
+        add_cubes_for_same_wavelength(new_folders_sorted, output_path, project_name)
     else:
         messagebox.showerror("Error", f"Expected {total_pictures} folders, but found {len(new_folders_sorted)} new folders.")
 
 
-def add_cubes_for_same_wavelength(folders):
+def add_cubes_for_same_wavelength(folders, output_folder, project):
     date_str = datetime.now().strftime("%m-%d")
 
     wavelength_dict = {}
     for folder in folders:
-        parts = folder.split('_')
-        if len(parts) >= 3:
-            wavelength = parts[2]
+        parsed = parse_capture_folder_name(os.path.basename(folder))
+        if parsed is not None:
+            wavelength = parsed[0]
             if wavelength not in wavelength_dict:
                 wavelength_dict[wavelength] = []
             wavelength_dict[wavelength].append(folder)
 
+    rgb_bands = (29, 19, 9)
+    register = drift_registration_var.get()
+
+    # Previous builds of this project, to skip the wavelengths whose inputs and parameters are unchanged
+    with closing(open_project_catalog(output_folder)) as connection:
+        builds = {row[0]: row[1:] for row in connection.execute(
+            "SELECT wavelength, build_key, inputs, rgb_file, hdr_file FROM union_builds WHERE project = ?",
+            (project,))}
+
+    previous_inputs = {}
+    for build in builds.values():
+        previous_inputs.update(json.loads(build[1]))
+
     for wavelength, folders in wavelength_dict.items():
-        combined_cube = None
-        first_hdr_metadata = None
+        capture_folders = [os.path.join(saved_images_directory, folder) for folder in folders]
+        inputs = get_capture_checksums(capture_folders, previous_inputs)
+        unknown_folders = [folder for folder in capture_folders if inputs[folder][2] is None]
+
+        build = builds.get(wavelength)
+        if build is not None and union_outputs_exist(build[2], build[3]):
+            # Captures whose size or mtime changed are hashed only when a previous build may still match
+            for folder in unknown_folders:
+                inputs[folder][2] = cube_checksum(folder)
+            unknown_folders = []
+
+            build_key = get_union_build_key(capture_folders, inputs, rgb_bands, register)
+            if build[0] == build_key:
+                logging.info(f"Combined cube for wavelength {wavelength} is up to date: {build[3]}")
+                # Store the current sizes and mtimes, so files touched without changing are not hashed again
+                if inputs != json.loads(build[1]):
+                    update_build_inputs(output_folder, project, wavelength, inputs)
+                continue
 
-        for folder in folders:
-            hdr_path = os.path.join(saved_images_directory, folder, 'spectral_image_processed_image.hdr')
-            bin_path = os.path.join(saved_images_directory, folder, 'spectral_image_processed_image.bin')
+        # Captures without a known checksum are hashed from the same reads that stack them
+        checksums = {} if unknown_folders else None
+        combined_cube, first_hdr_metadata = stack_captures(capture_folders, register=register, checksums=checksums)
+        for folder in unknown_folders:
+            inputs[folder][2] = checksums[folder]
+        build_key = get_union_build_key(capture_folders, inputs, rgb_bands, register)
 
-            cube = envi.open(hdr_path, bin_path)
-            cube_data = cube.load()
+        # The writes run in the background while the next wavelength is stacked
+        output_rgb_file = os.path.join(output_folder, f'{project}_{date_str}_{wavelength}_combined.png')
+        output_hdr_file = os.path.join(output_folder, f'{project}_{date_str}_{wavelength}_union.hdr')
+        record_build = make_build_recorder(output_folder, project, wavelength, build_key, inputs,
+                                           output_rgb_file, output_hdr_file)
 
-            if first_hdr_metadata is None:
-                first_hdr_metadata = cube.metadata
+        queue_write(f"combined RGB image for wavelength {wavelength} at {output_rgb_file}",
+                    write_rgb_file, output_rgb_file, combined_cube, rgb_bands, on_complete=record_build)
+        queue_write(f"combined cube for wavelength {wavelength} at {output_hdr_file}",
+                    write_envi_file, output_hdr_file, combined_cube, first_hdr_metadata, on_complete=record_build)
 
-            if combined_cube is None:
-                combined_cube = cube_data
-            else:
-                assert combined_cube.shape == cube_data.shape, f"Cubes must have the same dimensions: {folder}"
-                combined_cube += cube_data
 
-        rgb_bands = (29, 19, 9)
-        output_rgb_file = os.path.join(output_path, f'{project_name}_{date_str}_{wavelength}_combined.png')
-        spy.save_rgb(output_rgb_file, combined_cube, rgb_bands)
-        logging.info(f"Saved combined RGB image for wavelength {wavelength} at {output_rgb_file}")
+# Function to rebuild the union cubes of an archived project folder
+def reprocess_project():
+    folder_path = filedialog.askdirectory()
+    if not folder_path:
+        return
+
+    capture_folders = [folder for folder in find_capture_folders(folder_path)
+                       if parse_capture_folder_name(os.path.basename(folder)) is not None]
+    if not capture_folders:
+        messagebox.showerror("Error", f"No captures found in {folder_path}")
+        return
+
+    # Project folders hold captures named {project}_{date}_{wavelength}_{i}
+    project = os.path.basename(capture_folders[0]).split('_')[0]
 
-        output_hdr_file = os.path.join(output_path, f'{project_name}_{date_str}_{wavelength}_union.hdr')
-        envi.save_image(output_hdr_file, combined_cube, metadata=first_hdr_metadata, force=True)
-        logging.info(f"Saved combined cube for wavelength {wavelength} at {output_hdr_file}")
+    try:
+        add_cubes_for_same_wavelength(capture_folders, folder_path, project)
+    except Exception as e:
+        logging.error(f"Failed to reprocess project: {e}")
+        messagebox.showerror("Error", f"Failed to reprocess project: {e}")
 
 
 def open_project_window(new_folders_sorted):
@@ -281,6 +363,1032 @@ def rename_and_copy_folders(new_folders_sorted):
     messagebox.showinfo("Success", "Folders copied and renamed successfully!")
 
 
+# ----------- Write-Behind Output Functions -----------
+
+# Function to get the name a file is written under before it is renamed into place
+def get_partial_path(path):
+    base, ext = os.path.splitext(path)
+    return f"{base}.partial{ext}"
+
+
+def write_rgb_file(path, data, rgb_bands):
+    partial_path = get_partial_path(path)
+    spy.save_rgb(partial_path, data, rgb_bands)
+    os.replace(partial_path, path)
+
+
+def write_envi_file(hdr_path, data, metadata):
+    partial_hdr_path = get_partial_path(hdr_path)
+    envi.save_image(partial_hdr_path, data, metadata=metadata, force=True)
+    commit_envi_file(partial_hdr_path, hdr_path)
+
+
+# Function to rename a finished ENVI file into place; any old header is removed first and the
+# new header is moved last, so a header is never paired with a data file it was not written with
+def commit_envi_file(partial_hdr_path, hdr_path, ext='.img'):
+    if os.path.exists(hdr_path):
+        os.remove(hdr_path)
+    os.replace(os.path.splitext(partial_hdr_path)[0] + ext, os.path.splitext(hdr_path)[0] + ext)
+    os.replace(partial_hdr_path, hdr_path)
+
+
+# Function to remove what a failed write left under its partial names
+def remove_partial_files(path, ext='.img'):
+    partial_path = get_partial_path(path)
+    partial_paths = [partial_path]
+    if path.endswith('.hdr'):
+        partial_paths.append(os.path.splitext(partial_path)[0] + ext)
+
+    for partial_path in partial_paths:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+# Function to queue `write_function(path, data, *args)` on the writer pool; waits while the
+# pending buffers exceed the memory cap and returns the Future of the write
+def queue_write(description, write_function, path, data, *args, on_complete=None):
+    global pending_write_bytes, pending_writes
+    buffer_id = id(data)
+
+    with write_condition:
+        # A buffer shared by several queued writes (e.g. a union cube and its RGB image) is counted once
+        if buffer_id in pending_write_buffers:
+            pending_write_buffers[buffer_id][1] += 1
+        else:
+            nbytes = np.asarray(data).nbytes
+            # A single buffer larger than the cap is still admitted once nothing else is pending
+            while pending_write_bytes and pending_write_bytes + nbytes > write_memory_cap:
+                write_condition.wait()
+            pending_write_buffers[buffer_id] = [nbytes, 1]
+            pending_write_bytes += nbytes
+        pending_writes += 1
+
+    update_write_status()
+    return write_executor.submit(run_write, description, write_function, path, data, args, on_complete)
+
+
+def run_write(description, write_function, path, data, args, on_complete):
+    global pending_write_bytes, pending_writes
+    try:
+        write_function(path, data, *args)
+        write_results.put((description, None, on_complete))
+    except Exception as e:
+        write_results.put((description, e, None))
+        try:
+            remove_partial_files(path)
+        except OSError as cleanup_error:
+            logging.error(f"Failed to remove partial files of {path}: {cleanup_error}")
+        raise
+    finally:
+        with write_condition:
+            # The queued write keeps `data` alive, so its id is not reused before this release
+            pending_buffer = pending_write_buffers[id(data)]
+            pending_buffer[1] -= 1
+            if not pending_buffer[1]:
+                del pending_write_buffers[id(data)]
+                pending_write_bytes -= pending_buffer[0]
+            pending_writes -= 1
+            write_condition.notify_all()
+
+
+# Function to report finished and failed writes in the GUI (runs on the Tk thread)
+def process_write_results():
+    while True:
+        try:
+            description, error, on_complete = write_results.get_nowait()
+        except queue.Empty:
+            break
+
+        if error is None:
+            logging.info(f"Saved {description}")
+            if on_complete is None:
+                continue
+            # A failing callback must not stop the remaining results from being reported
+            try:
+                on_complete()
+            except Exception as e:
+                logging.error(f"Failed to finish saving {description}: {e}")
+                messagebox.showerror("Error", f"Failed to finish saving {description}: {e}")
+        else:
+            logging.error(f"Failed to save {description}: {error}")
+            messagebox.showerror("Error", f"Failed to save {description}: {error}")
+
+    update_write_status()
+
+
+def poll_write_results():
+    try:
+        process_write_results()
+    finally:
+        root.after(200, poll_write_results)
+
+
+def update_write_status():
+    write_status_label.config(text=f"Pending writes: {pending_writes}" if pending_writes else "")
+
+
+# Function to finish all queued writes before the application closes
+def close_application():
+    write_status_label.config(text=f"Finishing {pending_writes} pending writes...")
+    root.update_idletasks()
+    write_executor.shutdown(wait=True)
+    process_write_results()
+    root.destroy()
+
+
+# ----------- Cube Streaming and Calibration Functions -----------
+
+def get_capture_paths(folder):
+    hdr_path = os.path.join(folder, 'spectral_image_processed_image.hdr')
+    bin_path = os.path.join(folder, 'spectral_image_processed_image.bin')
+    return hdr_path, bin_path
+
+
+# Function to find the capture folders in a folder (the folder itself or its subfolders)
+def find_capture_folders(folder):
+    if os.path.exists(get_capture_paths(folder)[0]):
+        return [folder]
+
+    subfolders = sorted(f.path for f in os.scandir(folder) if f.is_dir())
+    return [subfolder for subfolder in subfolders if os.path.exists(get_capture_paths(subfolder)[0])]
+
+
+# Function to open a cube as a (rows, cols, bands) array that is read from disk on demand
+def open_cube_rows(hdr_path, bin_path=None):
+    cube = envi.open(hdr_path, bin_path)
+    data = cube.open_memmap(interleave='bip')
+    if data is None:
+        # Fall back to reading the whole cube if it cannot be memory-mapped
+        data = cube.load()
+    return cube, data
+
+
+# Function to apply the dark-frame and flat-field correction to rows [row_start, row_stop) of a cube
+def calibrate_block(block, row_start, row_stop, bands=slice(None)):
+    block = np.asarray(block, dtype=np.float32)
+
+    if master_dark is not None:
+        dark = master_dark[row_start:row_stop, :, bands]
+        assert dark.shape == block.shape, "Master dark must have the same dimensions as the cubes."
+        block = block - dark
+
+    if master_flat_gain is not None:
+        gain = master_flat_gain[row_start:row_stop, :, bands]
+        assert gain.shape == block.shape, "Master flat must have the same dimensions as the cubes."
+        block = block * gain
+
+    return block
+
+
+# Function to read rows [row_start, row_stop) of a cube resampled by a (row, col) shift,
+# so that output pixel (r, c) takes the value at (r + dy, c + dx); pixels shifted in from
+# outside the cube are zero
+def read_shifted_block(data, row_start, row_stop, shift, calibrate=True):
+    rows, cols, bands = data.shape
+    dy, dx = shift
+    iy, ix = int(np.floor(dy)), int(np.floor(dx))
+    fy, fx = np.float32(dy - iy), np.float32(dx - ix)
+
+    # Source region covering the output rows plus one neighbour row and column for interpolation
+    src_start = row_start + iy
+    src_stop = row_stop + iy + 1
+    region = np.zeros((src_stop - src_start, cols + 1, bands), dtype=np.float32)
+
+    clipped_start, clipped_stop = max(src_start, 0), min(src_stop, rows)
+    col_lo, col_hi = max(0, -ix), min(cols + 1, cols - ix)
+    if clipped_start < clipped_stop and col_lo < col_hi:
+        source = data[clipped_start:clipped_stop]
+        if calibrate:
+            source = calibrate_block(source, clipped_start, clipped_stop)
+        region[clipped_start - src_start:clipped_stop - src_start, col_lo:col_hi] = source[:, col_lo + ix:col_hi + ix]
+
+    # Bilinear interpolation between the four neighbouring source pixels
+    top = (1 - fx) * region[:-1, :-1] + fx * region[:-1, 1:]
+    bottom = (1 - fx) * region[1:, :-1] + fx * region[1:, 1:]
+    return (1 - fy) * top + fy * bottom
+
+
+# Function to read one band of a capture as a calibrated image; only BSQ and BIL files
+# avoid reading the whole cube, since a BIP band is interleaved with every other band
+def read_reference_band(folder, band):
+    hdr_path, bin_path = get_capture_paths(folder)
+    cube = envi.open(hdr_path, bin_path)
+    band_image = cube.read_band(band)
+    return calibrate_block(band_image, 0, band_image.shape[0], band)
+
+
+# Function to evaluate the correlation encoded by a cross-power spectrum on a fine grid around a peak
+# (matrix-multiply upsampled DFT); returns the grid coordinates and the correlation values
+def upsample_correlation_peak(cross_power, peak_row, peak_col):
+    rows, cols = cross_power.shape
+    region = int(np.ceil(1.5 * registration_upsample))
+    offsets = (np.arange(region) - region // 2) / registration_upsample
+    grid_rows = peak_row + offsets
+    grid_cols = peak_col + offsets
+
+    row_kernel = np.exp(2j * np.pi * grid_rows[:, None] * np.fft.fftfreq(rows)[None, :])
+    col_kernel = np.exp(2j * np.pi * np.fft.fftfreq(cols)[:, None] * grid_cols[None, :])
+    return grid_rows, grid_cols, (row_kernel @ cross_power @ col_kernel).real / (rows * cols)
+
+
+# Function to estimate the subpixel drift of each image against the first one by low-pass filtered
+# cross-correlation; returns an (n, 2) array of (row, col) shifts. Shifts whose correlation peak is
+# weak or whose size exceeds registration_max_shift are left at zero
+def estimate_drift_shifts(reference_images):
+    images = np.asarray(reference_images, dtype=np.float64)
+    count, rows, cols = images.shape
+
+    # Remove the mean and taper the edges so the image borders do not dominate the correlation
+    images = images - images.mean(axis=(1, 2), keepdims=True)
+    images *= np.outer(np.hanning(rows), np.hanning(cols))
+
+    # One batched FFT for all images. The spectra are low-passed rather than normalized to unit
+    # magnitude, so high frequencies that only carry noise do not outweigh the signal
+    freq_rows = np.fft.fftfreq(rows)[:, None]
+    freq_cols = np.fft.fftfreq(cols)[None, :]
+    lowpass = np.exp(-(freq_rows ** 2 + freq_cols ** 2) / (2 * registration_lowpass ** 2))
+    spectra = np.fft.fft2(images) * np.sqrt(lowpass)
+
+    energies = (np.abs(spectra) ** 2).sum(axis=(1, 2)) / (rows * cols)
+    cross_power = spectra * np.conj(spectra[0])
+    correlation = np.fft.ifft2(cross_power).real
+
+    shifts = np.zeros((count, 2))
+    for idx in range(1, count):
+        # Peaks past the middle correspond to negative shifts
+        peak_row, peak_col = np.unravel_index(correlation[idx].argmax(), (rows, cols))
+        peak_row = peak_row - rows if peak_row > rows // 2 else peak_row
+        peak_col = peak_col - cols if peak_col > cols // 2 else peak_col
+        if max(abs(peak_row), abs(peak_col)) > registration_max_shift:
+            logging.warning(f"Drift of image {idx} exceeds {registration_max_shift} pixels; not registering it")
+            continue
+
+        grid_rows, grid_cols, fine = upsample_correlation_peak(cross_power[idx], peak_row, peak_col)
+        fine_row, fine_col = np.unravel_index(fine.argmax(), fine.shape)
+
+        # Normalized correlation coefficient of the filtered images at the peak
+        strength = fine[fine_row, fine_col] / np.sqrt(energies[idx] * energies[0])
+        if strength < registration_min_peak:
+            logging.warning(f"Weak correlation peak ({strength:.2f}) for image {idx}; not registering it")
+            continue
+
+        shifts[idx] = grid_rows[fine_row], grid_cols[fine_col]
+
+    return shifts
+
+
+# Function to estimate the drift of each capture against the first one on the registration band
+def estimate_capture_shifts(capture_folders):
+    reference_images = [read_reference_band(folder, registration_band) for folder in capture_folders]
+    shifts = estimate_drift_shifts(reference_images)
+    for folder, (dy, dx) in zip(capture_folders, shifts):
+        logging.info(f"Drift of {os.path.basename(folder)}: {dy:.2f} rows, {dx:.2f} cols")
+    return shifts
+
+
+# Function to add a block of raw cube rows to a content checksum; cubes are hashed row by row
+# in (rows, cols, bands) order, so the checksum does not depend on the block size
+def update_cube_digest(digest, block):
+    digest.update(np.ascontiguousarray(block))
+
+
+# Function to sum capture cubes block by block, applying calibration and drift
+# registration as each block streams in; when a `checksums` dict is given, the content
+# checksum of each capture is computed from the same reads and stored in it by folder
+def stack_captures(capture_folders, calibrate=True, register=False, checksums=None):
+    combined_cube = None
+    first_hdr_metadata = None
+    shifts = estimate_capture_shifts(capture_folders) if register and len(capture_folders) > 1 else None
+
+    for capture_idx, folder in enumerate(capture_folders):
+        hdr_path, bin_path = get_capture_paths(folder)
+        cube, data = open_cube_rows(hdr_path, bin_path)
+
+        if first_hdr_metadata is None:
+            first_hdr_metadata = cube.metadata
+
+        if combined_cube is None:
+            combined_cube = np.zeros(data.shape, dtype=np.float32)
+        else:
+            assert combined_cube.shape == data.shape, f"Cubes must have the same dimensions: {folder}"
+
+        digest = hashlib.sha1() if checksums is not None else None
+        shift = shifts[capture_idx] if shifts is not None else (0, 0)
+        for row_start in range(0, data.shape[0], stream_block_rows):
+            row_stop = min(row_start + stream_block_rows, data.shape[0])
+            if digest is not None:
+                update_cube_digest(digest, data[row_start:row_stop])
+            if shift[0] or shift[1]:
+                block = read_shifted_block(data, row_start, row_stop, shift, calibrate)
+            else:
+                block = data[row_start:row_stop]
+                if calibrate:
+                    block = calibrate_block(block, row_start, row_stop)
+            combined_cube[row_start:row_stop] += block
+
+        if digest is not None:
+            checksums[folder] = digest.hexdigest()
+
+    return combined_cube, first_hdr_metadata
+
+
+# Function to fingerprint capture files by name, size and modification time
+def capture_signature(capture_folders, extra=""):
+    digest = hashlib.sha1(extra.encode('utf-8'))
+    for folder in capture_folders:
+        for path in get_capture_paths(folder):
+            stat = os.stat(path)
+            digest.update(f"{os.path.basename(folder)}/{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Function to build (or reuse) the averaged master cube for the captures in a folder
+def build_master_cube(folder, name, extra_signature="", postprocess=None):
+    capture_folders = find_capture_folders(folder)
+    if not capture_folders:
+        raise FileNotFoundError(f"No captures found in {folder}")
+
+    master_hdr = os.path.join(folder, f'master_{name}.hdr')
+    signature = capture_signature(capture_folders, extra_signature)
+
+    # Reuse the master from memory, then from disk, before rebuilding it
+    cached = calibration_masters.get(master_hdr)
+    if cached is not None and cached[0] == signature:
+        return signature, cached[1]
+
+    # Check the signature in the header before mapping the data, so a stale master is never
+    # mapped while it is being replaced
+    if os.path.exists(master_hdr) and envi.read_envi_header(master_hdr).get('lasersnap signature') == signature:
+        logging.info(f"Using cached master {name} from {master_hdr}")
+        _, master_data = open_cube_rows(master_hdr)
+        calibration_masters[master_hdr] = (signature, master_data)
+        return signature, master_data
+
+    # Drop the mapping of the stale master; the file cannot be replaced while it is mapped on Windows
+    cached = None
+    calibration_masters.pop(master_hdr, None)
+
+    logging.info(f"Building master {name} from {len(capture_folders)} captures in {folder}")
+    summed_cube, metadata = stack_captures(capture_folders, calibrate=False)
+    master_data = summed_cube / len(capture_folders)
+    if postprocess is not None:
+        master_data = postprocess(master_data)
+
+    metadata = dict(metadata)
+    metadata['lasersnap signature'] = signature
+    write_envi_file(master_hdr, master_data, metadata)
+    logging.info(f"Saved master {name} at {master_hdr}")
+
+    # Keep the master mapped from the file just written rather than as an array in memory
+    del summed_cube, master_data
+    _, master_data = open_cube_rows(master_hdr)
+    calibration_masters[master_hdr] = (signature, master_data)
+    return signature, master_data
+
+
+# Function to read the (rows, cols, bands) of a capture from its header
+def read_capture_shape(folder):
+    header = envi.read_envi_header(get_capture_paths(folder)[0])
+    return int(header['lines']), int(header['samples']), int(header['bands'])
+
+
+# Function to check that the calibration masters match the (rows, cols, bands) of a project's captures
+def check_calibration_shapes(capture_shapes):
+    for name, master in (('dark', master_dark), ('flat', master_flat_gain)):
+        if master is None:
+            continue
+        for shape in capture_shapes:
+            if tuple(master.shape) != tuple(shape):
+                raise ValueError(f"Master {name} has dimensions {tuple(master.shape)}, "
+                                 f"but the captures have dimensions {tuple(shape)}")
+
+
+# Function to load the master dark and flat for the designated calibration folders
+def load_calibration_masters():
+    global master_dark, master_flat_gain, calibration_signature
+    # Release the previous masters first so their files can be replaced if they are rebuilt
+    master_dark = None
+    master_flat_gain = None
+    calibration_signature = ""
+    dark_signature = ""
+
+    if dark_frame_folder:
+        dark_signature, master_dark = build_master_cube(dark_frame_folder, 'dark')
+
+    if flat_field_folder:
+        dark = master_dark
+
+        def normalize_flat(flat):
+            if dark is not None:
+                flat = flat - dark
+            # Normalize each band to a mean of one so the correction keeps the signal level
+            band_means = flat.mean(axis=(0, 1))
+            return flat / np.where(band_means > 0, band_means, 1)
+
+        flat_signature, master_flat = build_master_cube(flat_field_folder, 'flat', dark_signature, normalize_flat)
+        master_flat = np.asarray(master_flat, dtype=np.float32)
+        master_flat_gain = np.divide(1.0, master_flat, out=np.zeros_like(master_flat), where=master_flat > 0)
+
+    calibration_signature = f"{dark_signature}:{flat_signature if flat_field_folder else ''}"
+
+    # Forget the masters of folders that are no longer selected
+    selected_masters = {os.path.join(folder, f'master_{name}.hdr')
+                        for folder, name in ((dark_frame_folder, 'dark'), (flat_field_folder, 'flat')) if folder}
+    for master_hdr in list(calibration_masters):
+        if master_hdr not in selected_masters:
+            del calibration_masters[master_hdr]
+
+    update_calibration_label()
+
+    # Check the masters against the loaded project, so a mismatch is reported when they are selected
+    if current_project_folder:
+        with closing(open_project_catalog(current_project_folder)) as connection:
+            check_calibration_shapes(connection.execute("SELECT DISTINCT rows, cols, bands FROM captures").fetchall())
+
+
+def update_calibration_label():
+    status = []
+    if master_dark is not None:
+        status.append(f"Dark: {os.path.basename(dark_frame_folder)}")
+    if master_flat_gain is not None:
+        status.append(f"Flat: {os.path.basename(flat_field_folder)}")
+    calibration_label.config(text=", ".join(status) if status else "No calibration")
+
+
+# Function to select the folder of dark-frame captures
+def select_dark_folder():
+    global dark_frame_folder
+    folder = filedialog.askdirectory()
+    if folder:
+        previous_selection = (dark_frame_folder, flat_field_folder)
+        dark_frame_folder = folder
+        apply_calibration_selection(previous_selection)
+
+
+# Function to select the folder of flat-field captures
+def select_flat_folder():
+    global flat_field_folder
+    folder = filedialog.askdirectory()
+    if folder:
+        previous_selection = (dark_frame_folder, flat_field_folder)
+        flat_field_folder = folder
+        apply_calibration_selection(previous_selection)
+
+
+def clear_calibration():
+    global dark_frame_folder, flat_field_folder
+    dark_frame_folder = ""
+    flat_field_folder = ""
+    load_calibration_masters()
+
+
+# Function to load the masters for a new calibration selection, going back to the previous
+# (dark, flat) selection if they cannot be built
+def apply_calibration_selection(previous_selection):
+    global dark_frame_folder, flat_field_folder
+    try:
+        load_calibration_masters()
+    except Exception as e:
+        logging.error(f"Failed to build calibration masters: {e}")
+        messagebox.showerror("Error", f"Failed to build calibration masters: {e}")
+        dark_frame_folder, flat_field_folder = previous_selection
+        try:
+            load_calibration_masters()
+        except Exception as e:
+            logging.error(f"Failed to restore the previous calibration: {e}")
+            clear_calibration()
+
+
+# ----------- Union Build Cache Functions -----------
+
+# Function to read the content checksum of each capture from the catalog of its project folder,
+# for the captures whose files have not changed since they were cataloged
+def read_cataloged_checksums(capture_folders):
+    checksums = {}
+    captures_by_parent = {}
+    for folder in capture_folders:
+        captures_by_parent.setdefault(os.path.dirname(folder), []).append(folder)
+
+    for parent, folders in captures_by_parent.items():
+        if not os.path.exists(os.path.join(parent, catalog_file_name)):
+            continue
+
+        with closing(open_project_catalog(parent)) as connection:
+            cataloged = {row[0]: row[1:] for row in connection.execute(
+                "SELECT folder, bin_size, bin_mtime, checksum FROM captures")}
+
+        for folder in folders:
+            entry = cataloged.get(os.path.basename(folder))
+            bin_stat = os.stat(get_capture_paths(folder)[1])
+            if entry is not None and entry[:2] == (bin_stat.st_size, bin_stat.st_mtime_ns):
+                checksums[folder] = entry[2]
+
+    return checksums
+
+
+# Function to get the content checksums of capture inputs from the previous builds or the catalog;
+# the checksum is None for captures that changed since either recorded them
+def get_capture_checksums(capture_folders, previous_inputs):
+    cataloged_checksums = read_cataloged_checksums(capture_folders)
+
+    inputs = {}
+    for folder in capture_folders:
+        hdr_path, bin_path = get_capture_paths(folder)
+        stat = os.stat(bin_path)
+
+        previous = previous_inputs.get(folder)
+        if previous is not None and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+            bin_checksum = previous[2]
+        else:
+            bin_checksum = cataloged_checksums.get(folder)
+
+        inputs[folder] = [stat.st_size, stat.st_mtime_ns, bin_checksum, file_checksum(hdr_path)]
+    return inputs
+
+
+# Function to compute the content checksum of a capture in a separate streaming pass
+def cube_checksum(folder):
+    _, data = open_cube_rows(*get_capture_paths(folder))
+    digest = hashlib.sha1()
+    for row_start in range(0, data.shape[0], stream_block_rows):
+        update_cube_digest(digest, data[row_start:row_start + stream_block_rows])
+    return digest.hexdigest()
+
+
+def update_build_inputs(catalog_folder, project, wavelength, inputs):
+    with closing(open_project_catalog(catalog_folder)) as connection:
+        connection.execute("UPDATE union_builds SET inputs = ? WHERE project = ? AND wavelength = ?",
+                           (json.dumps(inputs), project, wavelength))
+        connection.commit()
+
+
+# Function to key a union cube by the content of its captures and the stacking parameters
+def get_union_build_key(capture_folders, inputs, rgb_bands, register):
+    checksums = [inputs[folder][2:] for folder in capture_folders]
+    parameters = {
+        # Summing does not depend on the capture order, but registration uses the first capture as reference
+        'inputs': checksums if register else sorted(checksums),
+        'rgb bands': list(rgb_bands),
+        'calibration': calibration_signature,
+        'registration': [registration_band, registration_lowpass, registration_upsample,
+                         registration_min_peak, registration_max_shift] if register else None,
+    }
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def union_outputs_exist(rgb_file, hdr_file):
+    return all(os.path.exists(path) for path in (rgb_file, hdr_file, os.path.splitext(hdr_file)[0] + '.img'))
+
+
+# Function to make the write callback that records a union build once both of its outputs are written
+def make_build_recorder(catalog_folder, project, wavelength, build_key, inputs, rgb_file, hdr_file):
+    remaining_outputs = [2]
+
+    def record_build():
+        remaining_outputs[0] -= 1
+        if remaining_outputs[0]:
+            return
+
+        with closing(open_project_catalog(catalog_folder)) as connection:
+            connection.execute("INSERT OR REPLACE INTO union_builds VALUES (?, ?, ?, ?, ?, ?)",
+                               (project, wavelength, build_key, json.dumps(inputs), rgb_file, hdr_file))
+            connection.commit()
+
+    return record_build
+
+
+# ----------- Project Catalog Functions -----------
+
+# Function to extract the wavelength and capture index from a capture folder name
+def parse_capture_folder_name(folder_name):
+    parts = folder_name.split('_')
+    if len(parts) < 3:
+        return None
+
+    wavelength = parts[2]
+    i = parts[3] if len(parts) > 3 else "1"  # Extract i or default to 1
+    return wavelength, i
+
+
+def open_project_catalog(folder_path):
+    connection = sqlite3.connect(os.path.join(folder_path, catalog_file_name))
+    connection.execute("""CREATE TABLE IF NOT EXISTS captures (
+        folder TEXT PRIMARY KEY,
+        wavelength TEXT NOT NULL,
+        capture_index TEXT NOT NULL,
+        rows INTEGER, cols INTEGER, bands INTEGER,
+        dtype TEXT, interleave TEXT,
+        hdr_size INTEGER, bin_size INTEGER,
+        hdr_mtime INTEGER, bin_mtime INTEGER,
+        checksum TEXT,
+        rgb_image TEXT,
+        calibration TEXT)""")
+    # Catalogs created before previews recorded their calibration get the column added
+    if 'calibration' not in [column[1] for column in connection.execute("PRAGMA table_info(captures)")]:
+        connection.execute("ALTER TABLE captures ADD COLUMN calibration TEXT")
+    connection.execute("CREATE INDEX IF NOT EXISTS captures_wavelength ON captures (wavelength)")
+    connection.execute("""CREATE TABLE IF NOT EXISTS union_builds (
+        project TEXT NOT NULL,
+        wavelength TEXT NOT NULL,
+        build_key TEXT NOT NULL,
+        inputs TEXT NOT NULL,
+        rgb_file TEXT,
+        hdr_file TEXT,
+        PRIMARY KEY (project, wavelength))""")
+    return connection
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to add new or changed captures to the catalog and drop the ones that are gone
+def update_project_catalog(connection, folder_path, folder_names, progress_callback=None):
+    known = {row[0]: row[1:] for row in connection.execute(
+        "SELECT folder, hdr_size, bin_size, hdr_mtime, bin_mtime, checksum, rgb_image, calibration FROM captures")}
+
+    cataloged_folders = 0
+    for folder_name in folder_names:
+        parsed = parse_capture_folder_name(folder_name)
+        subfolder = os.path.join(folder_path, folder_name)
+        hdr_path, bin_path = get_capture_paths(subfolder)
+
+        if parsed is None:
+            continue
+        if not (os.path.exists(hdr_path) and os.path.exists(bin_path)):
+            logging.warning(f"Hyperspectral files not found in {subfolder}")
+            continue
+
+        wavelength, i = parsed
+        hdr_stat = os.stat(hdr_path)
+        bin_stat = os.stat(bin_path)
+        file_state = (hdr_stat.st_size, bin_stat.st_size, hdr_stat.st_mtime_ns, bin_stat.st_mtime_ns)
+
+        # Previews are rendered through the calibration masters, so a calibration change re-renders them
+        entry = known.pop(folder_name, None)
+        files_unchanged = entry is not None and tuple(entry[:4]) == file_state
+        if (files_unchanged and entry[6] == calibration_signature
+                and entry[5] is not None and os.path.exists(os.path.join(folder_path, entry[5]))):
+            cataloged_folders += 1
+            if progress_callback is not None:
+                progress_callback(cataloged_folders)
+            continue
+
+        logging.info(f"Cataloging hyperspectral cube from: {hdr_path} and {bin_path}")
+        try:
+            header = envi.read_envi_header(hdr_path)
+            dtype = envi.envi_to_dtype.get(str(header.get('data type')))
+
+            # Stream the cube from disk, applying the dark and flat correction; the content
+            # checksum is computed from the same reads
+            checksums = {}
+            cube, _ = stack_captures([subfolder], checksums=checksums)
+
+            # Save the RGB image
+            rgb_bands = (29, 19, 9)  # Adjust these bands as needed
+            output_rgb_image = os.path.join(subfolder, 'rgb_image.png')
+            write_rgb_file(output_rgb_image, cube, rgb_bands)
+            logging.info(f"RGB image saved at: {output_rgb_image}")
+
+            connection.execute(
+                "INSERT OR REPLACE INTO captures (folder, wavelength, capture_index, rows, cols, bands, dtype, "
+                "interleave, hdr_size, bin_size, hdr_mtime, bin_mtime, checksum, rgb_image, calibration) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (folder_name, wavelength, i,
+                 int(header['lines']), int(header['samples']), int(header['bands']),
+                 np.dtype(dtype).name if dtype else None, header.get('interleave'),
+                 *file_state, checksums[subfolder],
+                 os.path.relpath(output_rgb_image, folder_path), calibration_signature))
+            connection.commit()
+        except Exception as e:
+            logging.error(f"Error loading or processing cube: {e}")
+            connection.execute("DELETE FROM captures WHERE folder = ?", (folder_name,))
+            connection.commit()
+            continue
+
+        cataloged_folders += 1
+        if progress_callback is not None:
+            progress_callback(cataloged_folders)
+
+    # Remove captures whose folders were deleted or renamed
+    connection.executemany("DELETE FROM captures WHERE folder = ?", [(folder,) for folder in known])
+    connection.commit()
+
+
+# ----------- Excitation-Emission Stack Functions -----------
+
+# Function to sort wavelength strings numerically where possible
+def sort_wavelengths(wavelengths):
+    def wavelength_key(wavelength):
+        try:
+            return 0, float(wavelength), wavelength
+        except ValueError:
+            return 1, 0.0, wavelength
+
+    return sorted(wavelengths, key=wavelength_key)
+
+
+# Function to split a union cube file name, {project}_{date}_{wavelength}_union.hdr, into (project, wavelength)
+def parse_union_cube_name(file_name):
+    if not file_name.endswith('_union.hdr'):
+        return None
+
+    parts = file_name[:-len('_union.hdr')].rsplit('_', 2)
+    if len(parts) < 3:
+        return None
+    return parts[0], parts[2]
+
+
+# Function to find the projects that have union cubes in a folder
+def find_union_projects(folder_path):
+    projects = set()
+    for entry in os.scandir(folder_path):
+        parsed = parse_union_cube_name(entry.name) if entry.is_file() else None
+        if parsed is not None:
+            projects.add(parsed[0])
+    return sorted(projects)
+
+
+# Function to find the union cubes of a project in a folder, keyed by excitation wavelength
+def find_union_cubes(folder_path, project):
+    union_cubes = {}
+    for entry in os.scandir(folder_path):
+        parsed = parse_union_cube_name(entry.name) if entry.is_file() else None
+        if parsed is None or parsed[0] != project:
+            continue
+
+        # Keep the most recent union cube if a wavelength was processed more than once
+        wavelength = parsed[1]
+        if wavelength not in union_cubes or entry.stat().st_mtime > os.path.getmtime(union_cubes[wavelength]):
+            union_cubes[wavelength] = entry.path
+
+    return union_cubes
+
+
+# Function to combine the union cubes of a project into one memory-mapped
+# (excitation, rows, cols, bands) stack with a JSON index of its axes
+def build_eem_stack(folder_path, project):
+    union_cubes = find_union_cubes(folder_path, project)
+    if not union_cubes:
+        raise FileNotFoundError(f"No union cubes of {project} found in {folder_path}")
+
+    excitation_wavelengths = sort_wavelengths(union_cubes)
+    sources = {wavelength: [os.path.basename(union_cubes[wavelength]), os.stat(union_cubes[wavelength]).st_mtime_ns]
+               for wavelength in excitation_wavelengths}
+
+    stack_path = os.path.join(folder_path, f'{project}_eem_stack.npy')
+    index_path = os.path.join(folder_path, f'{project}_eem_stack.json')
+
+    # Reuse the existing stack if it was built from the same union cubes
+    if os.path.exists(stack_path) and os.path.exists(index_path):
+        with open(index_path) as f:
+            if json.load(f).get('sources') == sources:
+                logging.info(f"EEM stack is up to date: {stack_path}")
+                return stack_path
+
+    first_cube, first_data = open_cube_rows(union_cubes[excitation_wavelengths[0]])
+    rows, cols, bands = first_data.shape
+
+    temp_stack_path = stack_path + '.tmp'
+    stack = np.lib.format.open_memmap(temp_stack_path, mode='w+', dtype=np.float32,
+                                      shape=(len(excitation_wavelengths), rows, cols, bands))
+
+    for excitation_idx, wavelength in enumerate(excitation_wavelengths):
+        _, data = open_cube_rows(union_cubes[wavelength])
+        assert data.shape == (rows, cols, bands), f"Union cubes must have the same dimensions: {union_cubes[wavelength]}"
+
+        # Copy the cube block by block so only one block is held in memory
+        for row_start in range(0, rows, stream_block_rows):
+            row_stop = min(row_start + stream_block_rows, rows)
+            stack[excitation_idx, row_start:row_stop] = data[row_start:row_stop]
+
+        logging.info(f"Added excitation {wavelength} to EEM stack from {union_cubes[wavelength]}")
+
+    stack.flush()
+    del stack
+    os.replace(temp_stack_path, stack_path)
+
+    with open(index_path, 'w') as f:
+        json.dump({
+            'excitation wavelengths': excitation_wavelengths,
+            'band wavelengths': first_cube.metadata.get('wavelength'),
+            'shape': [len(excitation_wavelengths), rows, cols, bands],
+            'sources': sources,
+        }, f, indent=2)
+
+    logging.info(f"Saved EEM stack at {stack_path}")
+    return stack_path
+
+
+# Function to open an EEM stack read-only; data is only read when sliced. The stack is laid out
+# (excitation, rows, cols, bands), so per-pixel queries read little, while band images are strided
+def open_eem_stack(stack_path):
+    stack = np.load(stack_path, mmap_mode='r')
+    with open(os.path.splitext(stack_path)[0] + '.json') as f:
+        index = json.load(f)
+    return stack, index
+
+
+def eem_excitation_index(index, wavelength):
+    return index['excitation wavelengths'].index(str(wavelength))
+
+
+# Excitation x bands matrix for a single pixel; reads one short run of bands per excitation
+def eem_pixel(stack, row, col):
+    return np.array(stack[:, row, col, :])
+
+
+# Rows x cols image for one excitation and one emission band; the band is interleaved with
+# the others, so this reads the whole excitation block from disk
+def eem_image(stack, excitation_idx, band):
+    return np.array(stack[excitation_idx, :, :, band])
+
+
+# One emission band across all excitations, for a single pixel or the whole image; the
+# whole-image profile reads the entire stack for the same reason as eem_image
+def eem_band_profile(stack, band, row=None, col=None):
+    if row is not None and col is not None:
+        return np.array(stack[:, row, col, band])
+    return np.array(stack[:, :, :, band])
+
+
+# Function to build an EEM stack for each project with union cubes in a folder selected in the GUI
+def build_eem_stack_from_folder():
+    folder_path = filedialog.askdirectory()
+    if not folder_path:
+        return
+
+    try:
+        projects = find_union_projects(folder_path)
+        if not projects:
+            raise FileNotFoundError(f"No union cubes found in {folder_path}")
+
+        stack_paths = [build_eem_stack(folder_path, project) for project in projects]
+        messagebox.showinfo("Success", "EEM stack saved at: " + ", ".join(stack_paths))
+    except Exception as e:
+        logging.error(f"Failed to build EEM stack: {e}")
+        messagebox.showerror("Error", f"Failed to build EEM stack: {e}")
+
+
+# ----------- Decomposition Functions -----------
+
+# Function to accumulate the band sums and cross products of a cube in one streaming pass; the
+# differences between horizontally adjacent pixels give the noise statistics used by MNF
+def accumulate_band_statistics(hdr_path):
+    _, data = open_cube_rows(hdr_path)
+    rows, cols, bands = data.shape
+
+    pixel_count = 0
+    band_sums = np.zeros(bands)
+    band_products = np.zeros((bands, bands))
+    noise_count = 0
+    noise_products = np.zeros((bands, bands))
+
+    for row_start in range(0, rows, stream_block_rows):
+        row_stop = min(row_start + stream_block_rows, rows)
+        block = np.asarray(data[row_start:row_stop], dtype=np.float64)
+
+        pixels = block.reshape(-1, bands)
+        pixel_count += len(pixels)
+        band_sums += pixels.sum(axis=0)
+        band_products += pixels.T @ pixels
+
+        differences = (block[:, 1:] - block[:, :-1]).reshape(-1, bands)
+        noise_count += len(differences)
+        noise_products += differences.T @ differences
+
+    return pixel_count, band_sums, band_products, noise_count, noise_products
+
+
+# Function to combine the band statistics of several cubes, accumulated in parallel
+def accumulate_project_statistics(hdr_paths):
+    with ThreadPoolExecutor(max_workers=decomposition_workers) as executor:
+        statistics = list(executor.map(accumulate_band_statistics, hdr_paths))
+
+    for hdr_path, cube_statistics in zip(hdr_paths, statistics):
+        assert cube_statistics[1].shape == statistics[0][1].shape, f"Cubes must have the same bands: {hdr_path}"
+
+    return tuple(sum(values) for values in zip(*statistics))
+
+
+# Function to compute the mean spectrum, the (bands, components) transform and the eigenvalues
+# of a PCA or MNF from accumulated band statistics
+def compute_components(statistics, method, num_components):
+    pixel_count, band_sums, band_products, noise_count, noise_products = statistics
+    mean = band_sums / pixel_count
+    covariance = band_products / pixel_count - np.outer(mean, mean)
+
+    whitening = None
+    if method == 'MNF':
+        # Whiten the noise, then the principal components of the whitened data are ordered by SNR
+        noise_covariance = noise_products / (2 * noise_count)
+        noise_values, noise_vectors = np.linalg.eigh(noise_covariance)
+        whitening = noise_vectors / np.sqrt(np.maximum(noise_values, 1e-12))
+        covariance = whitening.T @ covariance @ whitening
+
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1][:num_components]
+    transform = eigenvectors[:, order]
+    if whitening is not None:
+        transform = whitening @ transform
+
+    return mean, transform, eigenvalues[order]
+
+
+# Function to project a cube onto the components block by block and write the component images as ENVI
+def write_component_image(hdr_path, output_hdr_path, method, mean, transform, eigenvalues):
+    _, data = open_cube_rows(hdr_path)
+    rows, cols, _ = data.shape
+    num_components = transform.shape[1]
+
+    metadata = {
+        'description': f'{method} components of {os.path.basename(hdr_path)}',
+        'lines': rows,
+        'samples': cols,
+        'bands': num_components,
+        'header offset': 0,
+        'data type': 4,  # float32
+        'interleave': 'bip',
+        'byte order': 0 if np.little_endian else 1,
+        'band names': [f'{method} {k + 1}' for k in range(num_components)],
+        'eigenvalues': [f'{value:.6g}' for value in eigenvalues],
+    }
+    partial_hdr_path = get_partial_path(output_hdr_path)
+    partial_img_path = os.path.splitext(partial_hdr_path)[0] + '.img'
+
+    mean = mean.astype(np.float32)
+    transform = transform.astype(np.float32)
+    try:
+        envi.write_envi_header(partial_hdr_path, metadata)
+
+        # A plain memmap is released by `del`, so nothing holds the partial file open when it is
+        # renamed (Windows cannot rename an open file)
+        components = np.memmap(partial_img_path, dtype=np.float32, mode='w+', shape=(rows, cols, num_components))
+        for row_start in range(0, rows, stream_block_rows):
+            row_stop = min(row_start + stream_block_rows, rows)
+            block = np.asarray(data[row_start:row_stop], dtype=np.float32)
+            components[row_start:row_stop] = (block - mean) @ transform
+
+        components.flush()
+        del components
+    except Exception:
+        components = None
+        remove_partial_files(output_hdr_path)
+        raise
+
+    commit_envi_file(partial_hdr_path, output_hdr_path)
+    logging.info(f"Saved {method} components at {output_hdr_path}")
+
+
+# Function to decompose the union cubes of a project with PCA or MNF
+def decompose_union_cubes(folder_path, project, method, num_components):
+    union_cubes = find_union_cubes(folder_path, project)
+    if not union_cubes:
+        raise FileNotFoundError(f"No union cubes of {project} found in {folder_path}")
+
+    hdr_paths = [union_cubes[wavelength] for wavelength in sort_wavelengths(union_cubes)]
+    statistics = accumulate_project_statistics(hdr_paths)
+    mean, transform, eigenvalues = compute_components(statistics, method, num_components)
+    logging.info(f"{method} eigenvalues: {eigenvalues}")
+
+    output_hdr_paths = []
+    for hdr_path in hdr_paths:
+        output_hdr_path = hdr_path[:-len('.hdr')] + f'_{method.lower()}.hdr'
+        write_component_image(hdr_path, output_hdr_path, method, mean, transform, eigenvalues)
+        output_hdr_paths.append(output_hdr_path)
+
+    return output_hdr_paths
+
+
+# Function to run the decomposition selected in the GUI on a folder of union cubes
+def decompose_folder():
+    folder_path = filedialog.askdirectory()
+    if not folder_path:
+        return
+
+    method = decomposition_method.get()
+    try:
+        num_components = int(components_entry.get())
+        if num_components < 1:
+            raise ValueError(f"Number of components must be at least 1, got {num_components}")
+
+        projects = find_union_projects(folder_path)
+        if not projects:
+            raise FileNotFoundError(f"No union cubes found in {folder_path}")
+
+        output_hdr_paths = []
+        for project in projects:
+            output_hdr_paths += decompose_union_cubes(folder_path, project, method, num_components)
+        messagebox.showinfo("Success", f"Saved {method} components for {len(output_hdr_paths)} cubes in {folder_path}")
+    except Exception as e:
+        logging.error(f"Failed to compute {method} components: {e}")
+        messagebox.showerror("Error", f"Failed to compute {method} components: {e}")
+
+
 # ----------- Processing Tab Functions -----------
 
 loaded_images = []
@@ -419,6 +1527,8 @@ def update_wavelength_filter():
 
 
 def load_and_display_cubes(folder_path):
+    global current_project_folder
+
     # Clear previous images
     for widget in image_panel_frame.winfo_children():
         widget.destroy()
@@ -429,7 +1539,7 @@ def load_and_display_cubes(folder_path):
     sum_cubes_button.config(state="disabled")
     available_wavelengths.clear()
 
-    subfolders = [f.path for f in os.scandir(folder_path) if f.is_dir()]
+    subfolders = [f.name for f in os.scandir(folder_path) if f.is_dir()]
     total_subfolders = len(subfolders)
 
     if total_subfolders == 0:
@@ -439,151 +1549,96 @@ def load_and_display_cubes(folder_path):
 
     logging.info(f"Found {total_subfolders} subfolders.")
 
-    loaded_folders = 0  # Track the number of folders processed
-
-    # Loop through each subfolder and process the hyperspectral images
-    for subfolder in subfolders:
-        folder_name = os.path.basename(subfolder)
-        parts = folder_name.split('_')
-
-        if len(parts) >= 3:
-            wavelength = parts[2]  # Extract wavelength from the folder name
-            i = parts[3] if len(parts) > 3 else "1"  # Extract i or default to 1
+    # The captures of a project share their dimensions, so one header is enough to check the calibration
+    capture_folders = find_capture_folders(folder_path)
+    try:
+        if capture_folders:
+            check_calibration_shapes([read_capture_shape(capture_folders[0])])
+    except ValueError as e:
+        logging.error(f"Calibration does not match {folder_path}: {e}")
+        messagebox.showerror("Error", f"Calibration does not match the captures in {folder_path}: {e}")
+        progress_label.config(text=f"Loaded 0 of {total_subfolders} subfolders")
+        return
 
-            hdr_path = os.path.join(subfolder, 'spectral_image_processed_image.hdr')
-            bin_path = os.path.join(subfolder, 'spectral_image_processed_image.bin')
+    def report_progress(loaded_folders):
+        progress_label.config(text=f"Loaded {loaded_folders} of {total_subfolders} subfolders")
+        root.update_idletasks()
 
-            if os.path.exists(hdr_path) and os.path.exists(bin_path):
-                logging.info(f"Loading hyperspectral cube from: {hdr_path} and {bin_path}")
-                try:
-                    # Load the cube using spectral.io.envi
-                    meta_cube = envi.open(hdr_path, bin_path)
-                    cube = meta_cube.load()
+    # Bring the catalog up to date; only new or changed captures are opened
+    with closing(open_project_catalog(folder_path)) as connection:
+        update_project_catalog(connection, folder_path, subfolders, report_progress)
 
-                    # Define the RGB bands
-                    rgb_bands = (29, 19, 9)  # Adjust these bands as needed
+        captures = connection.execute(
+            "SELECT folder, wavelength, capture_index, rgb_image FROM captures ORDER BY wavelength, folder").fetchall()
+        available_wavelengths.update(row[0] for row in connection.execute("SELECT DISTINCT wavelength FROM captures"))
 
-                    # Save the RGB image
-                    output_rgb_image = os.path.join(subfolder, 'rgb_image.png')
-                    spy.save_rgb(output_rgb_image, cube, rgb_bands)
-                    logging.info(f"RGB image saved at: {output_rgb_image}")
+    current_project_folder = folder_path
 
-                    # Store the cube data and metadata, along with the path to the RGB image
-                    loaded_cubes.append((cube, meta_cube.metadata, wavelength, i, output_rgb_image))
-                    available_wavelengths.add(wavelength)  # Track unique wavelengths
+    for folder, wavelength, i, rgb_image in captures:
+        # Store the capture folder and the path to its RGB image; the cube is streamed when summed
+        loaded_cubes.append((os.path.join(folder_path, folder), wavelength, i, os.path.join(folder_path, rgb_image)))
+        add_image_to_panel(len(loaded_cubes) - 1)
 
-                    # Display the image
-                    img = Image.open(output_rgb_image)
-                    img = img.resize((300, 200), Image.Resampling.LANCZOS)
-                    img_tk = ImageTk.PhotoImage(img)
+    # Final update to the progress label in case all subfolders were processed
+    progress_label.config(text=f"Loaded {len(captures)} of {total_subfolders} subfolders")
 
-                    # Store the image to prevent garbage collection
-                    loaded_images.append(img_tk)
+    # Update the wavelength filter dropdown with the available wavelengths
+    update_wavelength_filter()
 
-                    # Create a frame for each image, its label, and checkbox
-                    image_frame = tk.Frame(image_panel_frame)
-                    image_frame.pack(side=tk.LEFT, padx=10, pady=10)
 
-                    # Display the image in the frame
-                    img_label = tk.Label(image_frame, image=img_tk)
-                    img_label.pack()
+# Function to display the RGB image of a loaded cube with its selection checkbox
+def add_image_to_panel(idx):
+    _, wavelength, i, output_rgb_image = loaded_cubes[idx]
+    if not os.path.exists(output_rgb_image):
+        return
 
-                    # Create a variable to track the checkbox state
-                    checkbox_var = tk.BooleanVar()
+    img = Image.open(output_rgb_image)
+    img = img.resize((300, 200), Image.Resampling.LANCZOS)
+    img_tk = ImageTk.PhotoImage(img)
 
-                    # Create a checkbox next to the image name and make it selectable
-                    checkbox = tk.Checkbutton(image_frame, text=f'{wavelength}_{i}', variable=checkbox_var,
-                                              onvalue=True, offvalue=False,
-                                              command=lambda idx=len(loaded_cubes) - 1,
-                                                             var=checkbox_var: toggle_image_selection(idx, var))
-                    checkbox.pack(pady=5)
+    # Store the image to prevent garbage collection
+    loaded_images.append(img_tk)
 
-                    # Update the progress after each subfolder is processed
-                    loaded_folders += 1
-                    progress_label.config(text=f"Loaded {loaded_folders} of {total_subfolders} subfolders")
-                    root.update_idletasks()
+    # Create a frame for each image, its label, and checkbox
+    image_frame = tk.Frame(image_panel_frame)
+    image_frame.pack(side=tk.LEFT, padx=10, pady=10)
 
-                except Exception as e:
-                    logging.error(f"Error loading or processing cube: {e}")
-            else:
-                logging.warning(f"Hyperspectral files not found in {subfolder}")
+    # Display the image in the frame
+    img_label = tk.Label(image_frame, image=img_tk)
+    img_label.pack()
 
-    # Final update to the progress label in case all subfolders were processed
-    progress_label.config(text=f"Loaded {loaded_folders} of {total_subfolders} subfolders")
+    # Create a variable to track the checkbox state
+    checkbox_var = tk.BooleanVar(value=idx in selected_images)
 
-    # Update the wavelength filter dropdown with the available wavelengths
-    update_wavelength_filter()
+    # Create a checkbox next to the image name and make it selectable
+    checkbox = tk.Checkbutton(image_frame, text=f'{wavelength}_{i}', variable=checkbox_var,
+                              onvalue=True, offvalue=False,
+                              command=lambda idx=idx, var=checkbox_var: toggle_image_selection(idx, var))
+    checkbox.pack(pady=5)
 
 
 # Function to filter the displayed images by wavelength
 def filter_images():
     selected_wavelength = wavelength_filter.get()
 
-    # If 'No Filter' is selected, display all images
-    if selected_wavelength == 'No Filter':
-        # Clear the current image panel
-        for widget in image_panel_frame.winfo_children():
-            widget.destroy()
-
-        # Display all loaded images
-        for idx, (cube, _, wavelength, i, output_rgb_image) in enumerate(loaded_cubes):
-            if os.path.exists(output_rgb_image):
-                img = Image.open(output_rgb_image)
-                img = img.resize((300, 200), Image.Resampling.LANCZOS)
-                img_tk = ImageTk.PhotoImage(img)
-
-                # Store the image to prevent garbage collection
-                loaded_images.append(img_tk)
-
-                # Create a frame for each image, its label, and checkbox
-                image_frame = tk.Frame(image_panel_frame)
-                image_frame.pack(side=tk.LEFT, padx=10, pady=10)
-
-                # Display the image in the frame
-                img_label = tk.Label(image_frame, image=img_tk)
-                img_label.pack()
-
-                # Create a variable to track the checkbox state
-                checkbox_var = tk.BooleanVar()
-
-                # Create a checkbox next to the image name and make it selectable
-                checkbox = tk.Checkbutton(image_frame, text=f'{wavelength}_{i}', variable=checkbox_var,
-                                          onvalue=True, offvalue=False,
-                                          command=lambda idx=idx, var=checkbox_var: toggle_image_selection(idx, var))
-                checkbox.pack(pady=5)
-        return
-
-    # Clear the current image panel if filtering by wavelength
+    # Clear the current image panel
     for widget in image_panel_frame.winfo_children():
         widget.destroy()
 
-    # Display only the images that match the selected wavelength
-    for idx, (cube, _, wavelength, i, output_rgb_image) in enumerate(loaded_cubes):
-        if wavelength == selected_wavelength:
-            if os.path.exists(output_rgb_image):
-                img = Image.open(output_rgb_image)
-                img = img.resize((300, 200), Image.Resampling.LANCZOS)
-                img_tk = ImageTk.PhotoImage(img)
-
-                # Store the image to prevent garbage collection
-                loaded_images.append(img_tk)
-
-                # Create a frame for each image, its label, and checkbox
-                image_frame = tk.Frame(image_panel_frame)
-                image_frame.pack(side=tk.LEFT, padx=10, pady=10)
-
-                # Display the image in the frame
-                img_label = tk.Label(image_frame, image=img_tk)
-                img_label.pack()
+    # If 'No Filter' is selected, display all images
+    if selected_wavelength == 'No Filter' or not current_project_folder:
+        for idx in range(len(loaded_cubes)):
+            add_image_to_panel(idx)
+        return
 
-                # Create a variable to track the checkbox state
-                checkbox_var = tk.BooleanVar()
+    # Display only the images that match the selected wavelength
+    with closing(open_project_catalog(current_project_folder)) as connection:
+        matching_folders = {os.path.join(current_project_folder, row[0]) for row in connection.execute(
+            "SELECT folder FROM captures WHERE wavelength = ?", (selected_wavelength,))}
 
-                # Create a checkbox next to the image name and make it selectable
-                checkbox = tk.Checkbutton(image_frame, text=f'{wavelength}_{i}', variable=checkbox_var,
-                                          onvalue=True, offvalue=False,
-                                          command=lambda idx=idx, var=checkbox_var: toggle_image_selection(idx, var))
-                checkbox.pack(pady=5)
+    for idx, (capture_folder, _, _, _) in enumerate(loaded_cubes):
+        if capture_folder in matching_folders:
+            add_image_to_panel(idx)
 
 # Function to sum the cubes from the selected images
 def sum_selected_cubes():
@@ -591,36 +1646,34 @@ def sum_selected_cubes():
         messagebox.showerror("Error", "No images selected for summing.")
         return
 
-    combined_cube = None
-    first_hdr_metadata = None
     rgb_bands = (29, 19, 9)  # Example of RGB bands
 
+    capture_folders = []
     for idx in selected_images:
-        cube_data, cube_metadata, wavelength, i, _ = loaded_cubes[idx]
-
+        capture_folder, wavelength, i, _ = loaded_cubes[idx]
         logging.info(f"Summing cube for {wavelength}_{i}")
+        capture_folders.append(capture_folder)
 
-        # Sum the cubes
-        if combined_cube is None:
-            combined_cube = cube_data
-            first_hdr_metadata = cube_metadata
-        else:
-            # Ensure the cubes have the same dimensions
-            assert combined_cube.shape == cube_data.shape, "Cubes must have the same dimensions for summing."
-            combined_cube += cube_data
+    # Sum the cubes, streaming each one from disk
+    try:
+        combined_cube, first_hdr_metadata = stack_captures(capture_folders, register=drift_registration_var.get())
+    except (AssertionError, ValueError) as e:
+        logging.error(f"Failed to sum the selected cubes: {e}")
+        messagebox.showerror("Error", f"Failed to sum the selected cubes: {e}")
+        return
 
     if combined_cube is not None:
-        # Save the summed RGB image temporarily
+        # Save the summed RGB image temporarily, in the background
         summed_rgb_image = os.path.join(saved_images_directory, 'summed_rgb_image.png')
-        spy.save_rgb(summed_rgb_image, combined_cube, rgb_bands)
-        logging.info(f"Summed RGB image saved at: {summed_rgb_image}")
+        rgb_future = queue_write(f"summed RGB image at {summed_rgb_image}",
+                                 write_rgb_file, summed_rgb_image, combined_cube, rgb_bands)
 
         # Show the combined image in a popup window and provide Save options
-        show_combined_image_popup(summed_rgb_image, combined_cube, first_hdr_metadata)
+        show_combined_image_popup(summed_rgb_image, rgb_future, combined_cube, first_hdr_metadata, rgb_bands)
     else:
         messagebox.showerror("Error", "Could not sum the selected cubes.")
 
-def save_rgb(image_path):
+def save_rgb(image_path, rgb_future):
     # Ask the user to select a directory to save the RGB image
     directory = filedialog.askdirectory()
     if not directory:
@@ -629,6 +1682,10 @@ def save_rgb(image_path):
     # Create the new file path
     rgb_save_path = os.path.join(directory, "summed_rgb_image.png")
 
+    # Wait until the summed RGB image has been written; a failed write is already reported by the write queue
+    if rgb_future.exception() is not None:
+        return
+
     try:
         shutil.copy(image_path, rgb_save_path)
         messagebox.showinfo("Success", f"RGB image saved at: {rgb_save_path}")
@@ -647,20 +1704,18 @@ def save_cube(summed_cube, metadata):
     hdr_save_path = os.path.join(directory, "summed_cube.hdr")
     bin_save_path = os.path.join(directory, "summed_cube.bin")
 
-    try:
-        # Save the hyperspectral cube using spectral.io.envi
-        envi.save_image(hdr_save_path, summed_cube, metadata=metadata, force=True)
-        messagebox.showinfo("Success", f"Summed cube saved at: {hdr_save_path}")
-    except Exception as e:
-        logging.error(f"Failed to save hyperspectral cube: {e}")
-        messagebox.showerror("Error", f"Failed to save hyperspectral cube: {e}")
+    # Save the hyperspectral cube in the background; failures are reported by process_write_results
+    queue_write(f"summed cube at {hdr_save_path}", write_envi_file, hdr_save_path, summed_cube, metadata,
+                on_complete=lambda: messagebox.showinfo("Success", f"Summed cube saved at: {hdr_save_path}"))
+
+
 # Function to show the summed RGB image in a popup window
-def show_combined_image_popup(image_path, summed_cube, metadata):
+def show_combined_image_popup(image_path, rgb_future, summed_cube, metadata, rgb_bands):
     popup = tk.Toplevel(root)
     popup.title("Summed Cube - RGB Image")
 
-    # Load and display the RGB image in the popup window
-    img = Image.open(image_path)
+    # Display the RGB image from memory while the file is written in the background
+    img = Image.fromarray((spy.get_rgb(summed_cube, rgb_bands) * 255).astype(np.uint8))
     img = img.resize((600, 400), Image.Resampling.LANCZOS)  # Resize for display
     img_tk = ImageTk.PhotoImage(img)
 
@@ -669,7 +1724,7 @@ def show_combined_image_popup(image_path, summed_cube, metadata):
     img_label.pack(pady=10)
 
     # Save RGB button
-    save_rgb_button = tk.Button(popup, text="Save RGB", command=lambda: save_rgb(image_path))
+    save_rgb_button = tk.Button(popup, text="Save RGB", command=lambda: save_rgb(image_path, rgb_future))
     save_rgb_button.pack(side=tk.LEFT, padx=10)
 
     # Save Cube button
@@ -689,114 +1744,160 @@ tls_device_address = None
 arduino_port = None
 trigger_string = 'trigger\n'
 
-root = tk.Tk()
-root.title("WaveTrigger - Laboratory Equipment Control")
-root.geometry("800x600")
+# The window is only built when the script is run, so the processing functions
+# (for example the EEM stack accessors) can be imported from a notebook
+if __name__ == '__main__':
+    root = tk.Tk()
+    root.title("WaveTrigger - Laboratory Equipment Control")
+    root.geometry("800x600")
+
+    # Create a notebook for tabs
+    notebook = ttk.Notebook(root)
+    notebook.pack(fill=tk.BOTH, expand=True)
+
+    # Create frames for each tab
+    acquisition_frame = tk.Frame(notebook)
+    processing_frame = tk.Frame(notebook)
+
+    # Add tabs to the notebook
+    notebook.add(acquisition_frame, text="Acquisition")
+    notebook.add(processing_frame, text="Processing")
+
+    # -------------------------------------------
+    # Acquisition Tab - Existing functionalities
+    # -------------------------------------------
+
+    columns = ("Wavelength", "Number of Pictures")
+    tree = ttk.Treeview(acquisition_frame, columns=columns, show="headings")
+    tree.heading("Wavelength", text="Wavelength (nm)")
+    tree.heading("Number of Pictures", text="Number of Pictures")
+    tree.pack(fill=tk.BOTH, expand=True)
+
+    device_frame = tk.Frame(acquisition_frame)
+    device_frame.pack(pady=10)
+
+    find_tls_button = tk.Button(device_frame, text="Find TLS", command=find_tls)
+    find_tls_button.pack(side=tk.LEFT, padx=10)
+
+    tls_status_label = tk.Label(device_frame, text="   ", bg='red', width=2)
+    tls_status_label.pack(side=tk.LEFT, padx=5)
+
+    find_golden_eye_button = tk.Button(device_frame, text="Find Golden Eye", command=find_golden_eye)
+    find_golden_eye_button.pack(side=tk.LEFT, padx=10)
+
+    golden_eye_status_label = tk.Label(device_frame, text="   ", bg='red', width=2)
+    golden_eye_status_label.pack(side=tk.LEFT, padx=5)
+
+    input_frame = tk.Frame(acquisition_frame)
+    input_frame.pack(fill=tk.X)
 
-# Create a notebook for tabs
-notebook = ttk.Notebook(root)
-notebook.pack(fill=tk.BOTH, expand=True)
+    tk.Label(input_frame, text="Wavelength:").pack(side=tk.LEFT, padx=5, pady=5)
+    wavelength_entry = tk.Entry(input_frame)
+    wavelength_entry.pack(side=tk.LEFT, padx=5, pady=5)
 
-# Create frames for each tab
-acquisition_frame = tk.Frame(notebook)
-processing_frame = tk.Frame(notebook)
+    tk.Label(input_frame, text="Number of Pictures:").pack(side=tk.LEFT, padx=5, pady=5)
+    pictures_entry = tk.Entry(input_frame)
+    pictures_entry.pack(side=tk.LEFT, padx=5, pady=5)
 
-# Add tabs to the notebook
-notebook.add(acquisition_frame, text="Acquisition")
-notebook.add(processing_frame, text="Processing")
+    add_button = tk.Button(input_frame, text="Add Row", command=add_row)
+    add_button.pack(side=tk.LEFT, padx=5, pady=5)
 
-# -------------------------------------------
-# Acquisition Tab - Existing functionalities
-# -------------------------------------------
+    execute_button = tk.Button(acquisition_frame, text="Execute Commands", command=execute_commands, state='disabled')
+    execute_button.pack(pady=10)
 
-columns = ("Wavelength", "Number of Pictures")
-tree = ttk.Treeview(acquisition_frame, columns=columns, show="headings")
-tree.heading("Wavelength", text="Wavelength (nm)")
-tree.heading("Number of Pictures", text="Number of Pictures")
-tree.pack(fill=tk.BOTH, expand=True)
+    process_button = tk.Button(acquisition_frame, text="Process Results", command=process_results, state='disabled')
+    process_button.pack(pady=10)
 
-device_frame = tk.Frame(acquisition_frame)
-device_frame.pack(pady=10)
+    # -------------------------------------------
+    # Processing Tab - New functionalities
+    # -------------------------------------------
 
-find_tls_button = tk.Button(device_frame, text="Find TLS", command=find_tls)
-find_tls_button.pack(side=tk.LEFT, padx=10)
+    # Filter Panel (Dropdown and Filter Button)
+    filter_panel = tk.Frame(processing_frame)
+    filter_panel.pack(pady=10, anchor='nw')
 
-tls_status_label = tk.Label(device_frame, text="   ", bg='red', width=2)
-tls_status_label.pack(side=tk.LEFT, padx=5)
+    # Wavelength filter dropdown
+    tk.Label(filter_panel, text="Filter by Wavelength:").pack(side=tk.LEFT, padx=5)
+    wavelength_filter = ttk.Combobox(filter_panel, state="readonly")
+    wavelength_filter.pack(side=tk.LEFT, padx=5)
 
-find_golden_eye_button = tk.Button(device_frame, text="Find Golden Eye", command=find_golden_eye)
-find_golden_eye_button.pack(side=tk.LEFT, padx=10)
+    # Filter button
+    filter_button = tk.Button(filter_panel, text="Filter", command=filter_images)
+    filter_button.pack(side=tk.LEFT, padx=10)
 
-golden_eye_status_label = tk.Label(device_frame, text="   ", bg='red', width=2)
-golden_eye_status_label.pack(side=tk.LEFT, padx=5)
+    load_folder_button = tk.Button(processing_frame, text="Load Folder", command=load_folder)
+    load_folder_button.pack(pady=10, anchor='nw')
 
-input_frame = tk.Frame(acquisition_frame)
-input_frame.pack(fill=tk.X)
+    # Calibration Panel (dark-frame and flat-field capture folders)
+    calibration_panel = tk.Frame(processing_frame)
+    calibration_panel.pack(pady=5, anchor='nw')
 
-tk.Label(input_frame, text="Wavelength:").pack(side=tk.LEFT, padx=5, pady=5)
-wavelength_entry = tk.Entry(input_frame)
-wavelength_entry.pack(side=tk.LEFT, padx=5, pady=5)
+    tk.Button(calibration_panel, text="Dark Frames", command=select_dark_folder).pack(side=tk.LEFT, padx=5)
+    tk.Button(calibration_panel, text="Flat Fields", command=select_flat_folder).pack(side=tk.LEFT, padx=5)
+    tk.Button(calibration_panel, text="Clear Calibration", command=clear_calibration).pack(side=tk.LEFT, padx=5)
 
-tk.Label(input_frame, text="Number of Pictures:").pack(side=tk.LEFT, padx=5, pady=5)
-pictures_entry = tk.Entry(input_frame)
-pictures_entry.pack(side=tk.LEFT, padx=5, pady=5)
+    calibration_label = tk.Label(calibration_panel, text="No calibration")
+    calibration_label.pack(side=tk.LEFT, padx=10)
 
-add_button = tk.Button(input_frame, text="Add Row", command=add_row)
-add_button.pack(side=tk.LEFT, padx=5, pady=5)
+    # Drift registration of captures before they are summed
+    drift_registration_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(calibration_panel, text="Drift Registration", variable=drift_registration_var).pack(side=tk.LEFT, padx=5)
 
-execute_button = tk.Button(acquisition_frame, text="Execute Commands", command=execute_commands, state='disabled')
-execute_button.pack(pady=10)
+    build_eem_button = tk.Button(processing_frame, text="Build EEM Stack", command=build_eem_stack_from_folder)
+    build_eem_button.pack(pady=5, anchor='nw')
 
-process_button = tk.Button(acquisition_frame, text="Process Results", command=process_results, state='disabled')
-process_button.pack(pady=10)
+    reprocess_button = tk.Button(processing_frame, text="Reprocess Project", command=reprocess_project)
+    reprocess_button.pack(pady=5, anchor='nw')
 
-# -------------------------------------------
-# Processing Tab - New functionalities
-# -------------------------------------------
+    # Decomposition Panel (PCA or MNF of a folder of union cubes)
+    decomposition_panel = tk.Frame(processing_frame)
+    decomposition_panel.pack(pady=5, anchor='nw')
 
-# Filter Panel (Dropdown and Filter Button)
-filter_panel = tk.Frame(processing_frame)
-filter_panel.pack(pady=10, anchor='nw')
+    tk.Label(decomposition_panel, text="Decomposition:").pack(side=tk.LEFT, padx=5)
+    decomposition_method = ttk.Combobox(decomposition_panel, state="readonly", values=['PCA', 'MNF'], width=6)
+    decomposition_method.set('PCA')
+    decomposition_method.pack(side=tk.LEFT, padx=5)
 
-# Wavelength filter dropdown
-tk.Label(filter_panel, text="Filter by Wavelength:").pack(side=tk.LEFT, padx=5)
-wavelength_filter = ttk.Combobox(filter_panel, state="readonly")
-wavelength_filter.pack(side=tk.LEFT, padx=5)
+    tk.Label(decomposition_panel, text="Components:").pack(side=tk.LEFT, padx=5)
+    components_entry = tk.Entry(decomposition_panel, width=5)
+    components_entry.insert(0, "10")
+    components_entry.pack(side=tk.LEFT, padx=5)
 
-# Filter button
-filter_button = tk.Button(filter_panel, text="Filter", command=filter_images)
-filter_button.pack(side=tk.LEFT, padx=10)
+    tk.Button(decomposition_panel, text="Decompose Folder", command=decompose_folder).pack(side=tk.LEFT, padx=10)
 
-load_folder_button = tk.Button(processing_frame, text="Load Folder", command=load_folder)
-load_folder_button.pack(pady=10, anchor='nw')
+    # Progress Label to display how many subfolders have been loaded
+    progress_label = tk.Label(processing_frame, text="Loaded 0 of 0 subfolders")
+    progress_label.pack(pady=5, anchor='nw')
 
-# Progress Label to display how many subfolders have been loaded
-progress_label = tk.Label(processing_frame, text="Loaded 0 of 0 subfolders")
-progress_label.pack(pady=5, anchor='nw')
+    # Create a scrollable horizontal panel for displaying images
+    canvas = tk.Canvas(processing_frame)
+    canvas.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
 
-# Create a scrollable horizontal panel for displaying images
-canvas = tk.Canvas(processing_frame)
-canvas.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+    scrollbar = ttk.Scrollbar(processing_frame, orient=tk.HORIZONTAL, command=canvas.xview)
+    scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
 
-scrollbar = ttk.Scrollbar(processing_frame, orient=tk.HORIZONTAL, command=canvas.xview)
-scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+    # Frame inside the canvas where images will be displayed
+    image_panel_frame = tk.Frame(canvas)
+    canvas.create_window((0, 0), window=image_panel_frame, anchor="nw")
+    canvas.configure(xscrollcommand=scrollbar.set)
 
-# Frame inside the canvas where images will be displayed
-image_panel_frame = tk.Frame(canvas)
-canvas.create_window((0, 0), window=image_panel_frame, anchor="nw")
-canvas.configure(xscrollcommand=scrollbar.set)
+    # Add a "Sum Cubes" button, initially disabled
+    sum_cubes_button = tk.Button(processing_frame, text="Sum Cubes", command=sum_selected_cubes, state="disabled")
+    sum_cubes_button.pack(pady=10)
 
-# Add a "Sum Cubes" button, initially disabled
-sum_cubes_button = tk.Button(processing_frame, text="Sum Cubes", command=sum_selected_cubes, state="disabled")
-sum_cubes_button.pack(pady=10)
 
+    # Function to resize the canvas when the number of images increases
+    def resize_canvas(event):
+        canvas.configure(scrollregion=canvas.bbox("all"))
 
-# Function to resize the canvas when the number of images increases
-def resize_canvas(event):
-    canvas.configure(scrollregion=canvas.bbox("all"))
 
+    image_panel_frame.bind("<Configure>", resize_canvas)
 
-image_panel_frame.bind("<Configure>", resize_canvas)
+    # Status of the background writes, checked periodically; pending writes are flushed on exit
+    write_status_label = tk.Label(root, text="")
+    write_status_label.pack(anchor='w', padx=5)
+    root.after(200, poll_write_results)
+    root.protocol("WM_DELETE_WINDOW", close_application)
 
-# Run the application
-root.mainloop()
\ No newline at end of file
+    # Run the application
+    root.mainloop()
\ No newline at end of file